@@ -2,18 +2,23 @@
 import os
 import io
 import time
-import pandas as pd
+import hashlib
+import threading
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
-from tenacity import retry, wait_fixed, stop_after_attempt
-from bs4 import BeautifulSoup
 from typing import Dict, List
 
+import llm_cache
 from search_providers import SerpAPISearcher, HunterClient
-from scraper import harvest_contact_from_url, soup_text, safe_get
+from scraper import (
+    harvest_contact_from_url, fetch_page, is_transient_error, REQUEST_TIMEOUT, TOTAL_PER_SITE_BUDGET
+)
 from utils import (
     build_queries_rule_based, compile_cert_terms, domain_from_url,
-    is_likely_supplier_result, is_blacklisted_domain, AGGREGATOR_BLACKLIST
+    is_likely_supplier_result, is_blacklisted_domain,
+    QUERY_EXCLUDE_DOMAINS, NEG_CLAUSE
 )
 
 # Optional OpenAI (for query shaping, domain filtering, and extraction)
@@ -23,6 +28,11 @@ try:
 except Exception:
     OpenAI = None
 
+MAX_SITE_WORKERS = 16   # supplier sites scraped concurrently (I/O bound)
+MAX_LLM_WORKERS = 20    # concurrent OpenAI contact-extraction calls (stay under RPM limits)
+LIVE_TABLE_EVERY = 2    # re-render the live results table every N scraped sites
+RESULT_COLUMNS = ["Supplier Name", "Website link", "Contact Address", "Contact Email", "Contact Phone Number"]
+
 load_dotenv()
 st.set_page_config(page_title="Supplier Finder — LLM Filtering, 5-column Output", layout="wide")
 st.title("🔎 Supplier Finder — LLM Query + Filtering (5-column Excel Output)")
@@ -30,10 +40,12 @@ st.title("🔎 Supplier Finder — LLM Query + Filtering (5-column Excel Output)
 # ---- Error log always visible ----
 error_box = st.container()
 error_log: List[str] = []
+_error_lock = threading.Lock()   # log_error is also called from scrape worker threads
 def log_error(msg: str):
-    error_log.append(msg)
-    with error_box:
-        st.error("• " + "\n• ".join(error_log))
+    with _error_lock:
+        error_log.append(msg)
+        with error_box:
+            st.error("• " + "\n• ".join(error_log))
 
 with st.sidebar:
     st.subheader("API Keys")
@@ -64,6 +76,24 @@ with st.form("search_form"):
     use_openai_extract = st.checkbox("Use OpenAI to improve contact parsing", value=bool(openai_key))
     submitted = st.form_submit_button("Search Suppliers")
 
+# ---------- Export helpers ----------
+def rows_to_xlsx(rows: List[Dict], columns: List[str], sheet_name: str) -> bytes:
+    """
+    Row-by-row XLSX in xlsxwriter's constant_memory mode (flushes each row to a temp file).
+    Written directly because pandas' to_excel emits cells column by column, which
+    constant_memory silently drops.
+    """
+    import xlsxwriter
+    buf = io.BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"constant_memory": True})
+    ws = wb.add_worksheet(sheet_name)
+    bold = wb.add_format({"bold": True})
+    ws.write_row(0, 0, columns, bold)
+    for r, row in enumerate(rows, start=1):
+        ws.write_row(r, 0, [row.get(c, "") for c in columns])
+    wb.close()
+    return buf.getvalue()
+
 # ---------- OpenAI helpers ----------
 def _get_client(api_key: str | None):
     if not OpenAI or not api_key:
@@ -104,35 +134,74 @@ Only return the queries as a JSON array of strings. Do not include explanations.
         log_error(f"OpenAI query generation failed: {e}")
         return []
 
-def ai_is_company_domain(client, domain: str, title: str, snippet: str, commodity: str, region: str, certification: str) -> bool:
+AI_FILTER_BATCH = 25   # domains per classifier call (keeps prompts well under token limits)
+DOMAIN_LABEL_CACHE_VERSION = "v2"   # bump when the classifier prompt or labelling rules change
+
+def _domain_cache_key(domain: str) -> str:
+    return f"domain:{DOMAIN_LABEL_CACHE_VERSION}:{domain}"
+
+def ai_filter_company_domains(client, items: List[Dict], commodity: str, region: str, certification: str) -> Dict[str, bool]:
     """
-    Lightweight classifier: 'company' vs 'marketplace/directory/aggregator'.
-    Short prompt, temperature 0, returns True if 'company'.
+    Batched classifier: 'company' vs 'marketplace/directory/aggregator' for many domains at once.
+    `items` are {"domain", "title", "snippet"} dicts; returns {domain: True if 'company'}.
+    One request per AI_FILTER_BATCH items, temperature 0, labels keyed by domain.
+    Domains without a clear label (failed call, missing key, other answers) are kept.
     """
     if not client:
-        return True  # if no LLM, allow (we still have hard blacklist)
-    text = f"title: {title}\nsnippet: {snippet}\ndomain: {domain}"
-    prompt = f"""
-Classify the website as either "company" or "marketplace".
+        return {it["domain"]: True for it in items}  # if no LLM, allow (we still have hard blacklist)
+    import json
+    # Classification is about the site, so the cache key is the domain alone (titles/snippets vary per query)
+    cached = llm_cache.get_many([_domain_cache_key(it["domain"]) for it in items])
+    decisions: Dict[str, bool] = {it["domain"]: cached[_domain_cache_key(it["domain"])]
+                                  for it in items if _domain_cache_key(it["domain"]) in cached}
+    items = [it for it in items if it["domain"] not in decisions]
+    for b in range(0, len(items), AI_FILTER_BATCH):
+        batch = items[b:b + AI_FILTER_BATCH]
+        listing = [{"domain": it["domain"], "title": it["title"], "snippet": it["snippet"]} for it in batch]
+        prompt = f"""
+Classify each website below as either "company" or "marketplace".
 - Treat directories, listings, B2B marketplaces, comparison portals, social networks, job boards as "marketplace".
 - We want manufacturer/company sites related to commodity '{commodity}', region '{region}', certification '{certification}'.
 
-Given:
-{text}
+For each item below, answer company|marketplace, keyed by the item's exact "domain" value.
+Return JSON of the form {{"labels": {{"example.com": "company", "other.com": "marketplace", ...}}}}
+with one entry per item.
 
-Answer with a single word: company or marketplace
+Items:
+{json.dumps(listing, ensure_ascii=False)}
 """
-    try:
-        r = client.chat.completions.create(
-            model="gpt-4o-mini",
-            temperature=0.0,
-            messages=[{"role":"user","content":prompt}]
-        )
-        ans = (r.choices[0].message.content or "").strip().lower()
-        return "company" in ans and "marketplace" not in ans
-    except Exception as e:
-        log_error(f"OpenAI domain filter failed for {domain}: {e}")
-        return True  # don't over-filter on failure
+        try:
+            r = client.chat.completions.create(
+                model="gpt-4o-mini",
+                temperature=0.0,
+                response_format={"type":"json_object"},
+                messages=[{"role":"user","content":prompt}]
+            )
+            labels = json.loads(r.choices[0].message.content).get("labels") or {}
+        except Exception as e:
+            log_error(f"OpenAI domain filter failed for {len(batch)} domains: {e}")
+            labels = {}
+        if not isinstance(labels, dict):   # e.g. a positional list or a bare string
+            log_error(f"OpenAI domain filter returned unusable labels for {len(batch)} domains; keeping them all")
+            labels = {}
+        labels = {str(k).strip().lower(): v for k, v in labels.items()}
+        fresh: Dict[str, bool] = {}
+        for it in batch:
+            label = labels.get(it["domain"])
+            ans = label.strip().lower() if isinstance(label, str) else ""
+            if "company" in ans and "marketplace" not in ans:
+                fresh[it["domain"]] = True
+            elif "marketplace" in ans and "company" not in ans:
+                fresh[it["domain"]] = False
+            else:
+                decisions[it["domain"]] = True  # don't over-filter on failure / missing labels (not cached)
+        decisions.update(fresh)
+        # Only cache a batch the model answered completely; a partial answer is not trusted across runs
+        if len(fresh) == len(batch):
+            llm_cache.put_many({_domain_cache_key(d): ok for d, ok in fresh.items()})
+        elif labels:
+            log_error(f"OpenAI domain filter labelled {len(fresh)}/{len(batch)} domains; not caching this batch")
+    return decisions
 
 def openai_structured_extract(client, html_text: str, base_url: str, commodity: str, region: str) -> Dict:
     """
@@ -142,6 +211,10 @@ def openai_structured_extract(client, html_text: str, base_url: str, commodity:
     if not client:
         return {}
     snippet = html_text[:12000]
+    cache_key = "extract:" + hashlib.sha1(f"{region}\n{snippet}".encode("utf-8")).hexdigest()
+    cached = llm_cache.get_many([cache_key])
+    if cache_key in cached:
+        return cached[cache_key]
     prompt = f"""
 You extract **precise contact data** from messy HTML/text for a supplier in region "{region}".
 
@@ -163,18 +236,48 @@ HTML/TEXT END
             messages=[{"role":"user","content":prompt}]
         )
         import json
-        return json.loads(r.choices[0].message.content)
+        out = json.loads(r.choices[0].message.content)
+        if out:
+            llm_cache.put_many({cache_key: out})
+        return out
     except Exception as e:
         log_error(f"OpenAI contact extraction failed for {base_url}: {e}")
         return {}
 
-@retry(wait=wait_fixed(1), stop=stop_after_attempt(3))
-def _fetch(url: str):
-    return safe_get(url)
+FETCH_ATTEMPTS = 3
+FETCH_BACKOFF = 0.3     # seconds; doubles after each failed attempt
+
+def _fetch(url: str, started: float | None = None):
+    """
+    GET with exponential backoff. Only transient failures are retried: timeouts and
+    connection resets (see scraper.is_transient_error), 429 and 5xx. DNS/SSL/URL/redirect
+    errors and other 4xx will never succeed, so they return immediately (None / the response).
+    A retry is only started if a full REQUEST_TIMEOUT still fits in TOTAL_PER_SITE_BUDGET,
+    counted from `started` (time.monotonic()); this is the only retry layer.
+    """
+    start = time.monotonic() if started is None else started
+    resp = None
+    for attempt in range(FETCH_ATTEMPTS):
+        try:
+            resp = fetch_page(url)
+        except Exception as e:
+            if not is_transient_error(e):
+                return None
+            resp = None
+        else:
+            if resp.status_code != 429 and resp.status_code < 500:
+                return resp
+        delay = FETCH_BACKOFF * (2 ** attempt)
+        if attempt == FETCH_ATTEMPTS - 1 or \
+                time.monotonic() - start + delay + REQUEST_TIMEOUT > TOTAL_PER_SITE_BUDGET:
+            break
+        time.sleep(delay)
+    return resp
 
 # ---------- Main ----------
 if submitted:
     t_start = time.perf_counter()
+    import pandas as pd   # heavy import; deferred so the idle form paints fast
 
     if not serp_key:
         log_error("Please paste a valid SerpAPI key.")
@@ -189,13 +292,12 @@ if submitted:
     if use_llm_query and client:
         base_queries = llm_build_queries(client, commodity, region, certification)
         if not base_queries:
-            base_queries = build_queries_rule_based(commodity, region, certification, AGGREGATOR_BLACKLIST)
+            base_queries = build_queries_rule_based(commodity, region, certification, QUERY_EXCLUDE_DOMAINS)
         else:
             # Always append negative site filters to the LLM queries
-            neg = " " + " ".join(f"-site:{d}" for d in AGGREGATOR_BLACKLIST)
-            base_queries = [q + neg for q in base_queries]
+            base_queries = [q + NEG_CLAUSE for q in base_queries]
     else:
-        base_queries = build_queries_rule_based(commodity, region, certification, AGGREGATOR_BLACKLIST)
+        base_queries = build_queries_rule_based(commodity, region, certification, QUERY_EXCLUDE_DOMAINS)
 
     # Search
     try:
@@ -209,19 +311,19 @@ if submitted:
     per_query = max(1, max_results // max(1, len(base_queries)))
 
     prog = st.progress(0.0)
-    for i, q in enumerate(base_queries, start=1):
-        try:
-            res = searcher.search(q, location=region, num=per_query)
-            all_results.extend(res)  # we only read organic_results in search_providers.py
-        except Exception as e:
-            log_error(f"Search failed for query: {q} — {e}")
-        finally:
-            prog.progress(i / len(base_queries))
+    results_by_query = {}
+    for i, (q, res, err) in enumerate(searcher.search_many(base_queries, location=region, num=per_query), start=1):
+        if err:
+            log_error(f"Search failed for query: {q} — {err}")
+        results_by_query[q] = res  # we only read organic_results in search_providers.py
+        prog.progress(i / len(base_queries))
+    # keep query order so earlier (broader) queries win the per-domain dedupe below
+    for q in base_queries:
+        all_results.extend(results_by_query.get(q, []))
 
     # Filter to likely supplier + remove blacklisted + (optional) AI domain filter
     st.info("Filtering to individual supplier sites…")
-    pruned, seen = [], set()
-    domain_decision_cache = {}
+    candidates, seen = [], set()
 
     for item in all_results:
         title, snippet, link = item.get("title",""), item.get("snippet",""), item.get("link","")
@@ -231,101 +333,143 @@ if submitted:
         if dom in seen:
             continue
         # hard blacklist first
-        if is_blacklisted_domain(dom, AGGREGATOR_BLACKLIST):
+        if is_blacklisted_domain(dom):
             continue
         # quick supplier hint check
         if not is_likely_supplier_result(title, snippet):
             continue
-        # optional AI classifier
-        if ai_domain_filter:
-            key = (dom, title, snippet)
-            if key in domain_decision_cache:
-                ok = domain_decision_cache[key]
-            else:
-                ok = ai_is_company_domain(client, dom, title, snippet, commodity, region, certification)
-                domain_decision_cache[key] = ok
-            if not ok:
-                continue
         seen.add(dom)
-        pruned.append(item)
+        candidates.append((dom, item))
+
+    # optional AI classifier (one batched call per AI_FILTER_BATCH domains)
+    if ai_domain_filter and client:
+        decisions = ai_filter_company_domains(
+            client,
+            [{"domain": dom, "title": it.get("title") or "", "snippet": it.get("snippet") or ""} for dom, it in candidates],
+            commodity, region, certification,
+        )
+        pruned = [it for dom, it in candidates if decisions.get(dom, True)]
+    else:
+        pruned = [it for _, it in candidates]
 
     if not pruned:
         log_error("No eligible supplier websites after filtering. Try broadening commodity/region/certification.")
         st.stop()
 
-    st.success(f"Scraping {len(pruned)} supplier sites (sequential)…")
+    st.success(f"Scraping {len(pruned)} supplier sites ({MAX_SITE_WORKERS} in parallel)…")
 
     # Scrape loop (timed)
     status = st.empty()
     bar = st.progress(0.0)
-    rows, timings = [], []
+    live_table = st.empty()   # rows as they land (heuristic contacts, before OpenAI normalization)
+    sites, timings = [], []
     hunter = HunterClient(api_key=hunter_key)
+    llm_enabled = bool(use_openai_extract and client)
 
-    for i, item in enumerate(pruned, start=1):
+    def scrape_one(item: Dict) -> tuple[Dict | None, Dict]:
+        """Scrape a single supplier site. Runs in a worker thread; returns (site or None, timing)."""
         url = item["link"]
-        status.info(f"⏳ Scraping: {url}")
-        t0 = time.perf_counter()
-        result_label = "Success"
+        t0, site_start = time.perf_counter(), time.monotonic()
+        site, result_label = None, "Success"
         try:
-            resp = _fetch(url)
+            resp = _fetch(url, started=site_start)
             if not (resp and resp.ok and resp.text):
                 result_label = "HTTP error"
                 raise RuntimeError(f"Bad response for {url}")
 
-            soup = BeautifulSoup(resp.text, "lxml")
-            text = soup_text(soup)
-
-            # Heuristic scrape (has time budget inside)
-            contact = harvest_contact_from_url(resp.url, region_hint="IN")
-
-            # OpenAI contact normalization (pick best for region)
-            if use_openai_extract and client and text:
-                llm = openai_structured_extract(client, text, resp.url, commodity, region)
-                if llm:
-                    contact["company_name"] = contact.get("company_name") or llm.get("company_name")
-                    # prefer LLM's region-specific best picks if available
-                    if llm.get("address_best"):
-                        contact["address"] = llm["address_best"]
-                    if llm.get("phones_best"):
-                        contact["phones"] = list({llm["phones_best"]})
-                    if llm.get("emails"):
-                        contact["emails"] = sorted(set((contact.get("emails") or []) + llm["emails"]))
+            # Heuristic scrape (has time budget inside); also hands back the homepage text
+            contact = harvest_contact_from_url(resp.url, region_hint="IN", resp=resp, started=site_start)
+            text = contact.pop("text", "")
 
             # Optional Hunter enrichment
             dom = domain_from_url(resp.url)
-            hunter_emails = hunter.domain_search(dom, limit=5) if hunter_key else []
-            emails = sorted(set((contact.get("emails") or []) + hunter_emails))
+            if hunter_key:
+                emails_set = set(contact.get("emails") or [])
+                emails_set.update(hunter.domain_search(dom, limit=5))
+                contact["emails"] = sorted(emails_set)
 
-            rows.append({
-                "Supplier Name": contact.get("company_name") or item.get("title") or dom,
-                "Website link": resp.url,
-                "Contact Address": contact.get("address") or "",
-                "Contact Email": ", ".join(emails[:5]),
-                "Contact Phone Number": ", ".join((contact.get("phones") or [])[:3]),
-            })
+            site = {"item": item, "url": resp.url, "domain": dom, "text": text, "contact": contact}
 
         except Exception as e:
             log_error(f"Scrape failed for {url}: {e}")
             result_label = f"Failed: {e}"
-        finally:
-            dt = time.perf_counter() - t0
-            timings.append({"Website": url, "Seconds": round(dt, 2), "Result": result_label})
+        dt = time.perf_counter() - t0
+        return site, {"Website": url, "Seconds": round(dt, 2), "Result": result_label}
+
+    def merge_llm(contact: Dict, llm: Dict) -> None:
+        """OpenAI contact normalization (pick best for region). Fields of the wrong type are ignored."""
+        if not llm or not isinstance(llm, dict):
+            return
+        if not contact.get("company_name") and isinstance(llm.get("company_name"), str):
+            contact["company_name"] = llm["company_name"]
+        # prefer LLM's region-specific best picks if available
+        if llm.get("address_best") and isinstance(llm["address_best"], str):
+            contact["address"] = llm["address_best"]
+        if llm.get("phones_best") and isinstance(llm["phones_best"], str):
+            contact["phones"] = [llm["phones_best"]]
+        if isinstance(llm.get("emails"), list):
+            emails_set = set(contact.get("emails") or [])
+            emails_set.update(e.strip() for e in llm["emails"] if isinstance(e, str) and e.strip())
+            contact["emails"] = sorted(emails_set)
+
+    def site_row(site: Dict) -> Dict:
+        contact, emails = site["contact"], site["contact"].get("emails") or []
+        return {
+            "Supplier Name": contact.get("company_name") or site["item"].get("title") or site["domain"],
+            "Website link": site["url"],
+            "Contact Address": contact.get("address") or "",
+            "Contact Email": ", ".join(emails[:5]),
+            "Contact Phone Number": ", ".join((contact.get("phones") or [])[:3]),
+        }
+
+    # Workers get the script context so log_error() can still write to the page.
+    # OpenAI extraction runs on its own pool, submitted as each site finishes scraping,
+    # so LLM latency overlaps the remaining scrapes instead of holding a scrape worker.
+    status.info(f"⏳ Scraping {len(pruned)} sites…")
+    ctx = get_script_run_ctx()
+    llm_futures = {}
+    with ThreadPoolExecutor(max_workers=MAX_SITE_WORKERS, initializer=add_script_run_ctx, initargs=(None, ctx)) as ex, \
+         ThreadPoolExecutor(max_workers=MAX_LLM_WORKERS, initializer=add_script_run_ctx, initargs=(None, ctx)) as llm_ex:
+        futures = [ex.submit(scrape_one, item) for item in pruned]
+        for i, fut in enumerate(as_completed(futures), start=1):
+            site, timing = fut.result()
+            if site:
+                sites.append(site)
+                if llm_enabled and site["text"]:
+                    fut_llm = llm_ex.submit(openai_structured_extract, client, site["text"], site["url"], commodity, region)
+                    llm_futures[fut_llm] = site
+            timings.append(timing)
             try:
-                st.toast(("✅ " if "Success" in result_label else "❌ ") + f"{url} — {dt:.2f}s")
+                st.toast(("✅ " if "Success" in timing["Result"] else "❌ ") + f"{timing['Website']} — {timing['Seconds']:.2f}s")
             except Exception:
                 pass
+            status.info(f"⏳ Scraped {i}/{len(pruned)}: {timing['Website']}")
             bar.progress(i / len(pruned))
+            if sites and (i % LIVE_TABLE_EVERY == 0 or i == len(pruned)):
+                live_table.dataframe(pd.DataFrame([site_row(x) for x in sites], columns=RESULT_COLUMNS),
+                                     use_container_width=True)
+
+        if llm_futures:
+            status.info(f"🤖 Waiting on OpenAI contact extraction for {len(llm_futures)} sites…")
+        for fut_llm in as_completed(llm_futures):
+            site = llm_futures[fut_llm]
+            try:
+                merge_llm(site["contact"], fut_llm.result())
+            except Exception as e:   # a bad payload only loses that site's LLM picks
+                log_error(f"OpenAI contact merge failed for {site['url']}: {e}")
+
+    rows = [site_row(site) for site in sites]
 
     status.empty()
+    live_table.empty()
 
     if not rows:
         log_error("No contacts extracted from any site.")
         st.stop()
 
     # Final 5-column output
-    df = pd.DataFrame(rows, columns=[
-        "Supplier Name", "Website link", "Contact Address", "Contact Email", "Contact Phone Number"
-    ])
+    df = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    csv_bytes = df.to_csv(index=False).encode("utf-8")   # serialized once, reused by the button
 
     st.subheader("Results (5 columns)")
     st.dataframe(df, use_container_width=True)
@@ -334,17 +478,14 @@ if submitted:
     with c1:
         st.download_button(
             "⬇️ Download CSV",
-            data=df.to_csv(index=False).encode("utf-8"),
+            data=csv_bytes,
             file_name="suppliers.csv",
             mime="text/csv",
         )
     with c2:
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="Suppliers")
         st.download_button(
             "⬇️ Download Excel (XLSX)",
-            data=buf.getvalue(),
+            data=rows_to_xlsx(rows, RESULT_COLUMNS, sheet_name="Suppliers"),
             file_name="suppliers.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
@@ -0,0 +1,29 @@
+# llm_cache.py
+import shelve
+import threading
+from typing import Dict, List
+
+# On-disk shelve of OpenAI answers (domain labels + contact extractions), reused across runs
+CACHE_PATH = ".llm_cache"
+
+# Lives in an imported module, not app.py: Streamlit re-executes app.py on every rerun and
+# session, so a lock defined there would not be shared. shelve is not safe for concurrent writers.
+_lock = threading.Lock()
+
+def get_many(keys: List[str]) -> Dict:
+    with _lock:
+        try:
+            with shelve.open(CACHE_PATH) as db:
+                return {k: db[k] for k in keys if k in db}
+        except Exception:
+            return {}
+
+def put_many(values: Dict) -> None:
+    if not values:
+        return
+    with _lock:
+        try:
+            with shelve.open(CACHE_PATH) as db:
+                db.update(values)
+        except Exception:
+            pass
@@ -1,39 +1,117 @@
 # scraper.py
-import re, time, json
+import re, time, json, threading
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
 from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
 from typing import Dict, List, Optional, Tuple
-import phonenumbers
 
 # ---- Tunables ----
 REQUEST_TIMEOUT = 12           # seconds per HTTP GET
 MAX_CONTACT_PAGES = 3          # follow at most N contact/about links
 TOTAL_PER_SITE_BUDGET = 25     # hard cap seconds per site (homepage + contact pages)
+MAX_PHONE_SCAN_CHARS = 200_000 # bound phonenumbers' scan on very large pages
+MAX_BYTES = 1_500_000          # cap on HTML downloaded + parsed per page
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml")
 
 HEADERS = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
 }
 CONTACT_HREF_HINTS = ["contact", "contact-us", "contacts", "impressum", "about", "company", "reach-us"]
 
 EMAIL_RE = re.compile(r"mailto:([^\?\"'>\s]+)|([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})", re.IGNORECASE)
-PHONE_RE = re.compile(r"(?:tel:|\+?\d[\d\s().-]{6,}\d)")
+
+# ---- HTTP sessions ----
+# requests.Session is not guaranteed thread-safe, so each scrape worker thread gets its own.
+POOL_SIZE = 32                 # connections kept per session
+
+_local = threading.local()
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    # No adapter-level retries: app._fetch is the single retry layer (bounded by the site budget)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _session() -> requests.Session:
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = _new_session()
+    return session
+
+def fetch_page(url: str, timeout: int = REQUEST_TIMEOUT) -> requests.Response:
+    """
+    Streams the body and keeps at most MAX_BYTES of it. Non-HTML responses (PDFs, images, …)
+    come back with an empty body, so callers skip them without downloading.
+    Raises requests exceptions; see is_transient_error() to decide whether a retry can help.
+    """
+    resp = _session().get(url, timeout=timeout, allow_redirects=True, stream=True)
+    try:
+        body = b""
+        ctype = resp.headers.get("Content-Type", "").lower()
+        if not ctype or ctype.startswith(HTML_CONTENT_TYPES):
+            chunks, size = [], 0
+            for chunk in resp.iter_content(chunk_size=64 * 1024):   # gzip/deflate decoded here
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= MAX_BYTES:
+                    break
+            body = b"".join(chunks)[:MAX_BYTES]
+        resp._content = body
+        return resp
+    finally:
+        resp.close()   # fully-read bodies go back to the pool; truncated/skipped ones drop the socket
 
 def safe_get(url: str, timeout: int = REQUEST_TIMEOUT) -> Optional[requests.Response]:
+    """fetch_page() that returns None instead of raising."""
     try:
-        return requests.get(url, headers=HEADERS, timeout=timeout, allow_redirects=True)
+        return fetch_page(url, timeout)
     except Exception:
         return None
 
-def soup_text(soup: BeautifulSoup) -> str:
-    for s in soup(["script","style","noscript"]):
-        s.decompose()
-    return " ".join(soup.get_text(separator=" ", strip=True).split())
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    True only for timeouts and plain connection resets (worth a retry). DNS failures,
+    refused connections, SSL, invalid-URL and redirect-loop errors will fail the same way again.
+    """
+    if isinstance(exc, requests.Timeout):
+        return True
+    if isinstance(exc, requests.exceptions.SSLError):
+        return False
+    if isinstance(exc, requests.exceptions.ChunkedEncodingError):
+        return True   # body cut off mid-stream
+    if not isinstance(exc, requests.ConnectionError):
+        return False
+    # requests wraps the socket error a few levels deep (MaxRetryError.reason, ProtocolError args, …)
+    seen, todo = set(), [exc]
+    while todo:
+        e = todo.pop()
+        if id(e) in seen or not isinstance(e, BaseException):
+            continue
+        seen.add(id(e))
+        if isinstance(e, (ConnectionResetError, ConnectionAbortedError)):   # incl. RemoteDisconnected
+            return True
+        todo.extend([*e.args, getattr(e, "reason", None), e.__cause__, e.__context__])
+    return False
+
+def soup_text(tree: LexborHTMLParser) -> str:
+    """Visible page text. Note: strips script/style/noscript from `tree` in place."""
+    tree.strip_tags(["script", "style", "noscript"])   # one C-side pass, no per-node Python loop
+    root = tree.body or tree.root
+    if root is None:
+        return ""
+    return " ".join(root.text(separator=" ", strip=True).split())
 
-def find_contact_links(base_url: str, soup: BeautifulSoup) -> List[str]:
+def find_contact_links(base_url: str, tree: LexborHTMLParser) -> List[str]:
     links = []
-    for a in soup.find_all("a", href=True):
-        href = a["href"].strip()
+    for a in tree.css("a[href]"):
+        href = (a.attributes.get("href") or "").strip()
         if any(h in href.lower() for h in CONTACT_HREF_HINTS):
             links.append(urljoin(base_url, href))
     # de-dup while preserving order
@@ -43,16 +121,20 @@ def find_contact_links(base_url: str, soup: BeautifulSoup) -> List[str]:
             seen.add(u); out.append(u)
     return out[:MAX_CONTACT_PAGES]
 
-def extract_emails(text: str, soup: Optional[BeautifulSoup] = None) -> List[str]:
+def _mailto_emails(tree: LexborHTMLParser) -> set:
     found = set()
-    if soup:
-        for a in soup.find_all("a", href=True):
-            if a["href"].lower().startswith("mailto:"):
-                m = EMAIL_RE.search(a["href"])
-                if m:
-                    email = m.group(1) or m.group(2)
-                    if email:
-                        found.add(email)
+    for a in tree.css("a[href]"):
+        href = a.attributes.get("href") or ""
+        if href.lower().startswith("mailto:"):
+            m = EMAIL_RE.search(href)
+            if m:
+                email = m.group(1) or m.group(2)
+                if email:
+                    found.add(email)
+    return found
+
+def extract_emails(text: str, tree: Optional[LexborHTMLParser] = None) -> List[str]:
+    found = _mailto_emails(tree) if tree else set()
     for m in EMAIL_RE.finditer(text):
         email = m.group(1) or m.group(2)
         if email:
@@ -60,22 +142,21 @@ def extract_emails(text: str, soup: Optional[BeautifulSoup] = None) -> List[str]
     return sorted(found)
 
 def extract_phones(text: str, default_region: str = "IN") -> List[str]:
-    candidates = {m.group(0) for m in PHONE_RE.finditer(text)}
+    import phonenumbers   # lazy: heavy metadata load kept off the app's cold start
+    # PhoneNumberMatcher scans free text itself, so one pass over the page beats a regex prefilter
     parsed = set()
-    for c in candidates:
-        c_clean = c.replace("tel:", "").strip()
-        try:
-            for match in phonenumbers.PhoneNumberMatcher(c_clean, default_region):
-                if phonenumbers.is_possible_number(match.number):
-                    parsed.add(phonenumbers.format_number(match.number, phonenumbers.PhoneNumberFormat.INTERNATIONAL))
-        except Exception:
-            pass
+    try:
+        for match in phonenumbers.PhoneNumberMatcher(text[:MAX_PHONE_SCAN_CHARS], default_region):
+            if phonenumbers.is_possible_number(match.number):
+                parsed.add(phonenumbers.format_number(match.number, phonenumbers.PhoneNumberFormat.INTERNATIONAL))
+    except Exception:
+        pass
     return sorted(parsed)
 
-def extract_jsonld_address(soup: BeautifulSoup) -> Optional[str]:
+def extract_jsonld_address(tree: LexborHTMLParser) -> Optional[str]:
     try:
-        for tag in soup.find_all("script", type="application/ld+json"):
-            data = json.loads(tag.get_text(strip=True))
+        for tag in tree.css('script[type="application/ld+json"]'):
+            data = json.loads(tag.text(strip=True))
             if isinstance(data, list):
                 for d in data:
                     addr = _pick_address(d)
@@ -103,37 +184,49 @@ def _pick_address(data: dict) -> Optional[str]:
         pass
     return None
 
-def extract_company_name(soup: BeautifulSoup) -> Optional[str]:
-    og = soup.find("meta", attrs={"property": "og:site_name"})
-    if og and og.get("content"):
-        return og["content"].strip()
-    title = (soup.title.string if soup.title else "").strip()
+def extract_company_name(tree: LexborHTMLParser) -> Optional[str]:
+    og = tree.css_first('meta[property="og:site_name"]')
+    if og and og.attributes.get("content"):
+        return og.attributes["content"].strip()
+    title_tag = tree.css_first("title")
+    title = (title_tag.text() if title_tag else "").strip()
     if title:
         return title.split("|")[0].split("–")[0].strip()
-    logo = soup.find("img", alt=True)
-    if logo and len(logo["alt"].strip()) > 2:
-        return logo["alt"].strip()
+    logo = tree.css_first("img[alt]")
+    alt = ((logo.attributes.get("alt") if logo else None) or "").strip()
+    if len(alt) > 2:
+        return alt
     return None
 
-def _harvest_once(url: str, region_hint: str) -> dict:
-    out = {"source_page": url, "company_name": None, "emails": [], "phones": [], "address": None}
-    resp = safe_get(url)
+def _harvest_once(url: str, region_hint: str,
+                  resp: Optional[requests.Response] = None) -> Tuple[dict, Optional[LexborHTMLParser]]:
+    """Scrape one page. Returns (fields, parsed tree or None) so callers can reuse the tree."""
+    out = {"source_page": url, "company_name": None, "emails": [], "phones": [], "address": None, "text": ""}
+    if resp is None:
+        resp = safe_get(url)
     if not resp or not resp.ok or not resp.text:
-        return out
-    soup = BeautifulSoup(resp.text, "lxml")
-    text = soup_text(soup)
-    out["company_name"] = extract_company_name(soup)
-    out["emails"] = extract_emails(text, soup)
+        return out, None
+    out["source_page"] = resp.url   # after redirects; contact links resolve against it
+    tree = LexborHTMLParser(resp.text)
+    # JSON-LD lives in <script> tags, so read it before soup_text() strips them
+    out["address"] = extract_jsonld_address(tree)
+    text = out["text"] = soup_text(tree)
+    out["company_name"] = extract_company_name(tree)
+    out["emails"] = extract_emails(text, tree)
     out["phones"] = extract_phones(text, region_hint)
-    out["address"] = extract_jsonld_address(soup)
-    return out
+    return out, tree
 
-def harvest_contact_from_url(url: str, region_hint: str = "IN") -> dict:
+def harvest_contact_from_url(url: str, region_hint: str = "IN",
+                             resp: Optional[requests.Response] = None,
+                             started: Optional[float] = None) -> dict:
     """
     Hard caps time spent per site to avoid hanging. Follows at most MAX_CONTACT_PAGES.
+    Pass `resp` if the homepage was already fetched, to skip downloading it again, and
+    `started` (time.monotonic() when that fetch began) so it counts against the site budget.
+    result["text"] is the homepage's visible text, so callers don't need to parse it themselves.
     """
-    start = time.monotonic()
-    result = _harvest_once(url, region_hint)
+    start = time.monotonic() if started is None else started
+    result, tree = _harvest_once(url, region_hint, resp)
 
     # Stop early if we already got everything
     if result["emails"] and result["phones"] and result["address"] and result["company_name"]:
@@ -145,26 +238,36 @@ def harvest_contact_from_url(url: str, region_hint: str = "IN") -> dict:
     if remaining() <= 0:
         return result
 
-    # Try contact/about pages
-    resp = safe_get(url)
-    if not resp or not resp.ok or not resp.text:
+    # Try contact/about pages (links come from the homepage tree parsed above — no second GET)
+    if tree is None:
+        return result
+    links = find_contact_links(result["source_page"], tree)
+    if not links:
         return result
-    soup = BeautifulSoup(resp.text, "lxml")
-    links = find_contact_links(resp.url, soup)
-    for link in links:
-        if remaining() <= 0:
-            break
-        sub = _harvest_once(link, region_hint)
-        result["emails"] = sorted(set(result["emails"] + sub.get("emails", [])))
-        result["phones"] = sorted(set(result["phones"] + sub.get("phones", [])))
-        if not result["address"] and sub.get("address"):
-            result["address"] = sub["address"]
-        if not result["company_name"] and sub.get("company_name"):
-            result["company_name"] = sub["company_name"]
-
-        if result["emails"] and result["phones"] and result["address"] and result["company_name"]:
-            break
+    # Fetch them concurrently; merge as they land and stop once every field is filled or the budget runs out.
+    # One small pool per site, so every link starts immediately instead of queueing behind other sites.
+    pool = ThreadPoolExecutor(max_workers=MAX_CONTACT_PAGES, thread_name_prefix="contact")
+    futures = [pool.submit(_harvest_once, link, region_hint) for link in links]
+    emails, phones = set(result["emails"]), set(result["phones"])   # dedupe incrementally, sort once
+    try:
+        for fut in as_completed(futures, timeout=max(0, remaining())):
+            sub, _ = fut.result()
+            emails.update(sub.get("emails", []))
+            phones.update(sub.get("phones", []))
+            if not result["address"] and sub.get("address"):
+                result["address"] = sub["address"]
+            if not result["company_name"] and sub.get("company_name"):
+                result["company_name"] = sub["company_name"]
+
+            if emails and phones and result["address"] and result["company_name"]:
+                break
+    except FuturesTimeout:
+        pass
+    finally:
+        # Don't wait on stragglers; in-flight pages finish on their own under REQUEST_TIMEOUT
+        pool.shutdown(wait=False, cancel_futures=True)
 
+    result["emails"], result["phones"] = sorted(emails), sorted(phones)
     return result
 
 def find_cert_mentions(html_text: str, terms: List[str]) -> Tuple[bool, Optional[str]]:
@@ -1,14 +1,25 @@
 import os
+import threading
 import requests
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Iterator, Optional, Tuple
 
 SERPAPI_URL = "https://serpapi.com/search.json"
+SERPAPI_MAX_WORKERS = 8   # concurrent SerpAPI queries in search_many
 
 class SerpAPISearcher:
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("SERPAPI_API_KEY", "").strip()
         if not self.api_key:
             raise ValueError("SERPAPI_API_KEY is not set. Please set it in your .env or Streamlit sidebar.")
+        # requests.Session is not guaranteed thread-safe, so each search_many worker gets its own
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
 
     def search(self, query: str, location: Optional[str] = None, num: int = 10) -> List[Dict]:
         params = {
@@ -21,7 +32,7 @@ class SerpAPISearcher:
         if location:
             params["location"] = location
 
-        r = requests.get(SERPAPI_URL, params=params, timeout=30)
+        r = self._session().get(SERPAPI_URL, params=params, timeout=30)
         r.raise_for_status()
         data = r.json()
         organic = data.get("organic_results", [])
@@ -35,6 +46,22 @@ class SerpAPISearcher:
             })
         return results
 
+    def search_many(self, queries: List[str], location: Optional[str] = None, num: int = 10,
+                    max_workers: int = SERPAPI_MAX_WORKERS) -> Iterator[Tuple[str, List[Dict], Optional[Exception]]]:
+        """
+        Run `search` for every query concurrently (queries are independent).
+        Yields (query, results, error) as each finishes; a failed query yields ([], exc).
+        """
+        if not queries:
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as ex:
+            futures = {ex.submit(self.search, q, location, num): q for q in queries}
+            for fut in as_completed(futures):
+                try:
+                    yield futures[fut], fut.result(), None
+                except Exception as e:
+                    yield futures[fut], [], e
+
 # Optional: Hunter.io for email enrichment
 class HunterClient:
     def __init__(self, api_key: Optional[str] = None):
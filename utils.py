@@ -1,5 +1,8 @@
 # utils.py
-import tldextract
+import os
+import re
+import tempfile
+from functools import lru_cache
 from urllib.parse import urlparse
 
 # ---- Marketplace / Directory blacklist (can expand anytime) ----
@@ -17,12 +20,24 @@ AGGREGATOR_BLACKLIST = [
     "google.com", "maps.google.com",
 ]
 
+# Worst offenders only: Google honours ~32 operators per query, so the `-site:` clause stays short.
+# is_blacklisted_domain() still checks the full AGGREGATOR_BLACKLIST client-side.
+QUERY_EXCLUDE_DOMAINS = [
+    "indiamart.com", "tradeindia.com", "exportersindia.com", "justdial.com",
+    "alibaba.com", "made-in-china.com", "linkedin.com", "facebook.com",
+]
+
 SUPPLIER_HINT_WORDS = [
     "supplier","manufacturer","distributor","fabricator","oem","factory",
     "exporter","wholesaler","vendor","machining","stamping","molding","casting",
     "tooling","die casting","injection molding","cnc","sheet metal","foundry"
 ]
 
+# Precompiled lookups (str.endswith(tuple) and a single alternation regex both dispatch in C)
+_BLACKLIST_SUFFIXES = tuple(AGGREGATOR_BLACKLIST)
+# Substring semantics on purpose (no trailing \b) so plurals like "manufacturers" still match
+_HINT_RE = re.compile("|".join(map(re.escape, SUPPLIER_HINT_WORDS)), re.IGNORECASE)
+
 CERT_SYNONYMS = {
     "IATF 16949": ["IATF 16949","TS 16949"],
     "ISO 9001": ["ISO9001","ISO 9001","ISO-9001"],
@@ -35,12 +50,21 @@ CERT_SYNONYMS = {
     "CE": ["CE","CE Marking"],
 }
 
+@lru_cache(maxsize=1)
+def _tld_extractor():
+    # lazy: loads the public-suffix list; not needed until results arrive.
+    # Bundled PSL snapshot only (no network refresh), parsed once per process.
+    import tldextract
+    return tldextract.TLDExtract(cache_dir=os.path.join(tempfile.gettempdir(), "tldextract"),
+                                 suffix_list_urls=())
+
+@lru_cache(maxsize=4096)   # the same URL often comes back from several queries
 def domain_from_url(url: str) -> str:
     try:
         parsed = urlparse(url)
         if not parsed.netloc:
             return ""
-        ext = tldextract.extract(url)
+        ext = _tld_extractor()(url)
         if ext.registered_domain:
             return ext.registered_domain.lower()
         return parsed.netloc.lower()
@@ -48,14 +72,14 @@ def domain_from_url(url: str) -> str:
         return ""
 
 def is_likely_supplier_result(title: str, snippet: str) -> bool:
-    title_l = (title or "").lower()
-    snip_l = (snippet or "").lower()
-    return any(w in title_l or w in snip_l for w in SUPPLIER_HINT_WORDS)
+    return bool(_HINT_RE.search(title or "") or _HINT_RE.search(snippet or ""))
 
 def _negative_site_clause(blacklist: list[str]) -> str:
     # Append `-site:domain` for each blacklisted domain
     return " " + " ".join(f"-site:{d}" for d in blacklist)
 
+NEG_CLAUSE = _negative_site_clause(QUERY_EXCLUDE_DOMAINS)
+
 def build_queries_rule_based(commodity: str, region: str, certification: str, blacklist: list[str] | None = None) -> list[str]:
     """Classic (non-LLM) query set with negative site filters."""
     base = f'"{commodity}" {region} "{certification}" supplier'
@@ -72,9 +96,11 @@ def build_queries_rule_based(commodity: str, region: str, certification: str, bl
         queries = [q + neg for q in queries]
     return queries
 
-def is_blacklisted_domain(domain: str, blacklist: list[str]) -> bool:
+def is_blacklisted_domain(domain: str, blacklist: list[str] | None = None) -> bool:
+    """Defaults to AGGREGATOR_BLACKLIST (suffix tuple precomputed); endswith covers exact matches too."""
     domain = (domain or "").lower()
-    return any(domain.endswith(b) for b in blacklist)
+    suffixes = _BLACKLIST_SUFFIXES if blacklist is None else tuple(blacklist)
+    return domain.endswith(suffixes)
 
 def unique_keep_order(seq):
     seen = set(); out = []